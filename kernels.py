@@ -0,0 +1,226 @@
+"""
+Interchangeable backends for the two hot loops of raycast.py: casting a ray
+for every screen column, and working out how dark each wall slice is.
+
+The kernels below are written in a restricted style (plain loops, math and
+numpy element access) so that the very same source runs either interpreted
+by CPython or compiled by Numba.  A backend is picked by name with load();
+"auto" uses Numba when it is installed and falls back to the pure Python
+and NumPy kernels otherwise.  The RAYCAST_BACKEND environment variable sets
+the default.
+
+Every step of a cast ray is one row of STEP_FIELDS values.  Step zero is
+always the starting point; the last step is the wall hit, or the first step
+beyond the cast range.
+"""
+
+import os
+import math
+import warnings
+import numpy as np
+
+
+DEFAULT_BACKEND = os.environ.get("RAYCAST_BACKEND", "auto")
+
+STEP_FIELDS = ("x", "y", "distance", "material", "shading", "offset")
+X, Y, DISTANCE, MATERIAL, SHADING, OFFSET = range(len(STEP_FIELDS))
+
+BACKENDS = {}
+
+_loaded = {}
+
+
+class Backend(object):
+    """A named pair of kernels, with helpers to allocate and warm them up."""
+    def __init__(self, name, cast_rays, shade):
+        """
+        The cast_rays and shade arguments are callables with the signatures
+        of cast_rays_kernel and shade_numpy.
+        """
+        self.name = name
+        self.cast_rays_kernel = cast_rays
+        self.shade = shade
+
+    def cast_rays(self, grid, x, y, directions, cast_range):
+        """
+        Cast one ray per angle in directions from (x, y) across grid, an
+        array of material IDs.  Returns an array of shape (rays, max_steps,
+        len(STEP_FIELDS)) and the number of valid steps in each ray.
+        """
+        steps = np.zeros((len(directions), max_steps(cast_range),
+                          len(STEP_FIELDS)))
+        counts = np.zeros(len(directions), dtype=np.int64)
+        self.cast_rays_kernel(grid, float(x), float(y),
+                              np.asarray(directions, dtype=np.float64),
+                              float(cast_range), steps, counts)
+        return steps, counts
+
+    def warm_up(self):
+        """
+        Run both kernels once on a tiny map so that any compilation happens
+        now, not on the first frame.  Compiled kernels are specialized on
+        argument types, so callers must pass floats for light and
+        light_range just as this does.
+        """
+        grid = np.ones((4, 4), dtype=np.uint8)
+        grid[1:3,1:3] = 0
+        steps, counts = self.cast_rays(grid, 1.5, 1.5, np.zeros(2), 1.0)
+        self.shade(steps[:,:,DISTANCE], steps[:,:,SHADING], 0.0, 1.0)
+
+
+def register(name):
+    """Decorator adding a Backend factory to BACKENDS under name."""
+    def decorator(factory):
+        BACKENDS[name] = factory
+        return factory
+    return decorator
+
+
+def load(name=DEFAULT_BACKEND):
+    """
+    Return the named backend, creating and warming it up on first use.
+    If "auto" is given, or the requested backend can't be loaded (its
+    library isn't installed), the first available of numba and python is
+    used instead.
+    """
+    if name == "auto":
+        candidates = ["numba", "python"]
+    else:
+        if name not in BACKENDS:
+            message = "Unknown kernel backend {!r}; choose from {}."
+            raise ValueError(message.format(name, sorted(BACKENDS)))
+        candidates = [name, "python"]
+    for candidate in candidates:
+        if candidate not in _loaded:
+            try:
+                backend = BACKENDS[candidate]()
+            except ImportError as error:
+                if name != "auto":
+                    message = "Kernel backend {!r} unavailable ({})."
+                    warnings.warn(message.format(name, error))
+                continue
+            backend.warm_up()
+            _loaded[candidate] = backend
+        return _loaded[candidate]
+
+
+def available():
+    """Return the names of the backends that can be loaded here."""
+    names = []
+    for name, factory in sorted(BACKENDS.items()):
+        try:
+            factory()
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def max_steps(cast_range):
+    """
+    The most steps a ray can take before exceeding cast_range.  A ray
+    crosses at most range*sqrt(2)+2 grid lines, plus one step beyond the
+    range and the starting point.
+    """
+    return int(math.ceil(cast_range*math.sqrt(2)))+4
+
+
+def cast_rays_kernel(grid, x, y, directions, cast_range, steps, counts):
+    """
+    Cast a ray for each direction (in radians), stopping when a cell with a
+    material greater than zero is hit or the cast range is exceeded, and
+    fill in steps and counts as described in Backend.cast_rays.  Cells off
+    the grid have material -1.  At each step the ray advances to whichever
+    of the next vertical or horizontal grid line is closer.
+    """
+    size_x, size_y = grid.shape
+    limit = steps.shape[1]
+    # Step lengths use sqrt rather than math.hypot: CPython and Numba
+    # implement hypot differently, while sqrt is exactly rounded on both.
+    for ray in range(directions.shape[0]):
+        sin = math.sin(directions[ray])
+        cos = math.cos(directions[ray])
+        px, py = x, y
+        next_x_x = next_x_y = next_y_x = next_y_y = 0.0
+        distance = 0.0
+        material = 0
+        steps[ray,0,X] = px
+        steps[ray,0,Y] = py
+        count = 1
+        while material <= 0 and distance <= cast_range and count < limit:
+            if cos == 0:
+                length_x = np.inf
+            else:
+                dx = math.floor(px+1)-px if cos > 0 else math.ceil(px-1)-px
+                dy = dx*(sin/cos)
+                next_x_x, next_x_y = px+dx, py+dy
+                length_x = math.sqrt(dx*dx+dy*dy)
+            if sin == 0:
+                length_y = np.inf
+            else:
+                dy = math.floor(py+1)-py if sin > 0 else math.ceil(py-1)-py
+                dx = dy*(cos/sin)
+                next_y_x, next_y_y = px+dx, py+dy
+                length_y = math.sqrt(dy*dy+dx*dx)
+            if length_x < length_y:
+                px, py, length = next_x_x, next_x_y, length_x
+                cell_x = px-1 if cos < 0 else px
+                cell_y = py
+                shading = 2 if cos < 0 else 0
+                offset = py
+            else:
+                px, py, length = next_y_x, next_y_y, length_y
+                cell_x = px
+                cell_y = py-1 if sin < 0 else py
+                shading = 2 if sin < 0 else 1
+                offset = px
+            ix = int(math.floor(cell_x))
+            iy = int(math.floor(cell_y))
+            if 0 <= ix < size_x and 0 <= iy < size_y:
+                material = grid[ix,iy]
+            else:
+                material = -1
+            distance += length
+            steps[ray,count,X] = px
+            steps[ray,count,Y] = py
+            steps[ray,count,DISTANCE] = distance
+            steps[ray,count,MATERIAL] = material
+            steps[ray,count,SHADING] = shading
+            steps[ray,count,OFFSET] = offset-math.floor(offset)
+            count += 1
+        counts[ray] = count
+
+
+def shade_numpy(distances, shadings, light, light_range):
+    """
+    Return the alpha (0 to 255) of the shadow drawn over a wall slice for
+    arrays of step distances and shading values.  Walls get darker with
+    distance and on their shaded faces, and lighter during lightning.
+    """
+    max_light = (distances+shadings)/light_range-light
+    return 255*np.minimum(1, np.maximum(max_light, 0))
+
+
+def shade_kernel(distances, shadings, light, light_range):
+    """The same as shade_numpy, as an explicit loop for compilation."""
+    alphas = np.empty(distances.shape)
+    for i in range(distances.shape[0]):
+        for j in range(distances.shape[1]):
+            max_light = (distances[i,j]+shadings[i,j])/light_range-light
+            alphas[i,j] = 255*min(1.0, max(max_light, 0.0))
+    return alphas
+
+
+@register("python")
+def python_backend():
+    """Rays cast by interpreted Python; shading vectorized with NumPy."""
+    return Backend("python", cast_rays_kernel, shade_numpy)
+
+
+@register("numba")
+def numba_backend():
+    """Both kernels compiled by Numba, cached on disk between runs."""
+    import numba
+    compile_kernel = numba.njit(cache=True)
+    return Backend("numba", compile_kernel(cast_rays_kernel),
+                   compile_kernel(shade_kernel))
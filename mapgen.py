@@ -0,0 +1,231 @@
+"""
+Seeded, vectorized map generation shared by both ray casting examples.
+
+Every algorithm takes a numpy RandomState and a map size and returns a
+boolean array that is True wherever a wall should be.  The same algorithm,
+size, seed and options always produce the same map, which makes maps
+reproducible for benchmarking.  RandomState is used rather than the newer
+Generator interface because numpy guarantees its stream never changes
+between versions.
+
+New algorithms are added with the register decorator:
+
+    @register("my_algorithm")
+    def my_algorithm(rng, size, **options):
+        ...
+"""
+
+import threading
+import numpy as np
+
+
+DEFAULT_ALGORITHM = "uniform"
+
+ALGORITHMS = {}
+
+
+def register(name):
+    """Decorator adding a wall layout function to ALGORITHMS under name."""
+    def decorator(function):
+        ALGORITHMS[name] = function
+        return function
+    return decorator
+
+
+def generate(algorithm, size, seed, values=(1,), **options):
+    """
+    Generate a size by size map with the named algorithm.  Each wall cell is
+    given a value chosen at random from values (material IDs or heights);
+    empty cells are zero.  The returned array has the dtype of values.
+    Extra keyword options are passed to the algorithm.
+    """
+    try:
+        layout = ALGORITHMS[algorithm]
+    except KeyError:
+        message = "Unknown map algorithm {!r}; choose from {}."
+        raise ValueError(message.format(algorithm, sorted(ALGORITHMS)))
+    rng = np.random.RandomState(seed)
+    walls = layout(rng, size, **options)
+    values = np.asarray(values)
+    choices = values[rng.randint(len(values), size=walls.shape)]
+    return np.where(walls, choices, 0).astype(values.dtype)
+
+
+class GenerationTimeout(Exception):
+    """Raised when a background map is not ready within the timeout."""
+
+
+class BackgroundGenerator(object):
+    """
+    Runs generate() on a worker thread so a new map can be built while the
+    game keeps rendering.  The worker still shares the GIL with the game:
+    numpy releases it only inside some large array operations, while the
+    carving loop of rooms and the small per-step arrays of cellular and
+    noise hold it, so frames can slow down while a large map generates.
+    """
+    def __init__(self, *args, **kwargs):
+        """Arguments are the same as those of generate()."""
+        self.grid = None
+        self.error = None
+        self.thread = threading.Thread(target=self.run, args=args,
+                                       kwargs=kwargs)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self, *args, **kwargs):
+        """Thread target; stores the result or the raised exception."""
+        try:
+            self.grid = generate(*args, **kwargs)
+        except Exception as error:
+            self.error = error
+
+    def done(self):
+        """Return True once the map has finished generating."""
+        return not self.thread.is_alive()
+
+    def result(self, timeout=None):
+        """
+        Wait for the map and return it, re-raising any generation error.
+        Raises GenerationTimeout if timeout seconds pass first.
+        """
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            message = "Map not generated within {} seconds."
+            raise GenerationTimeout(message.format(timeout))
+        if self.error is not None:
+            raise self.error
+        return self.grid
+
+
+def nearest_open_cell(grid, x, y):
+    """
+    Return the center of the empty cell of grid closest to the point (x, y),
+    or None if there are no empty cells.  Used to place the player inside
+    maps whose border is walled off.
+    """
+    cells = np.argwhere(grid == 0)
+    if not len(cells):
+        return None
+    centers = cells+0.5
+    nearest = ((centers-(x, y))**2).sum(axis=1).argmin()
+    return float(centers[nearest,0]), float(centers[nearest,1])
+
+
+def count_neighbors(walls):
+    """
+    Return the number of walls among the eight neighbors of every cell.
+    Cells beyond the edge of the map count as walls.
+    """
+    size_x, size_y = walls.shape
+    padded = np.pad(walls.astype(np.uint8), 1, mode="constant",
+                    constant_values=1)
+    count = np.zeros(walls.shape, dtype=np.uint8)
+    for dx in (0, 1, 2):
+        for dy in (0, 1, 2):
+            if dx != 1 or dy != 1:
+                count += padded[dx:dx+size_x, dy:dy+size_y]
+    return count
+
+
+def value_noise(rng, size, scale):
+    """
+    Return a size by size array of smooth noise in the range [0, 1), made by
+    bilinearly interpolating a grid of random values spaced scale cells
+    apart.
+    """
+    cells = size//scale+2
+    lattice = rng.random_sample((cells, cells))
+    position = np.arange(size)/float(scale)
+    index = position.astype(int)
+    fraction = position-index
+    fraction = fraction*fraction*(3-2*fraction)
+    fx, fy = fraction[:,np.newaxis], fraction[np.newaxis,:]
+    ix, iy = index[:,np.newaxis], index[np.newaxis,:]
+    top = lattice[ix, iy]*(1-fy)+lattice[ix, iy+1]*fy
+    bottom = lattice[ix+1, iy]*(1-fy)+lattice[ix+1, iy+1]*fy
+    return top*(1-fx)+bottom*fx
+
+
+@register("uniform")
+def uniform(rng, size, density=0.3):
+    """Every cell independently has a density chance of being a wall."""
+    return rng.random_sample((size, size)) < density
+
+
+@register("noise")
+def noise(rng, size, density=0.3, scale=8, octaves=3):
+    """
+    Threshold layered value noise, giving clustered walls and open areas.
+    The threshold is chosen so that a density fraction of cells are walls.
+    """
+    total = np.zeros((size, size))
+    weight = 1.0
+    for _ in range(octaves):
+        total += value_noise(rng, size, max(scale, 1))*weight
+        scale //= 2
+        weight /= 2
+    threshold = np.percentile(total, 100*(1-density))
+    return total > threshold
+
+
+@register("cellular")
+def cellular(rng, size, fill=0.45, iterations=4, birth=5, survival=4):
+    """
+    Cave-like maps from a cellular automaton.  Starting from random noise, an
+    empty cell becomes a wall with at least birth wall neighbors and a wall
+    remains with at least survival wall neighbors.
+    """
+    walls = rng.random_sample((size, size)) < fill
+    for _ in range(iterations):
+        neighbors = count_neighbors(walls)
+        walls = np.where(walls, neighbors >= survival, neighbors >= birth)
+    return walls
+
+
+@register("rooms")
+def rooms(rng, size, min_room=3, max_room=8, loops=0.3):
+    """
+    Rectangular rooms carved out of solid rock.  The map is split into square
+    sectors holding one room each.  Every room is joined by an L-shaped
+    corridor to its neighbor along x, which links each row of sectors.  The
+    rooms in the first column of sectors are joined to their neighbor along
+    y, linking the rows together, so every room can be reached.  The others
+    are joined along y with probability loops.  Carving uses slice
+    assignment, so the cost grows with the number of rooms rather than the
+    number of cells.
+    """
+    max_room = max(min(max_room, size-2), 1)
+    min_room = max(min(min_room, max_room), 1)
+    sector = max_room+2
+    count = max(size//sector, 1)
+    shape = (count, count)
+    widths = rng.randint(min_room, max_room+1, size=shape)
+    heights = rng.randint(min_room, max_room+1, size=shape)
+    slack_x = rng.random_sample(shape)*(sector-widths-1)
+    slack_y = rng.random_sample(shape)*(sector-heights-1)
+    corners = np.indices(shape)*sector
+    lefts = corners[0]+1+slack_x.astype(int)
+    tops = corners[1]+1+slack_y.astype(int)
+    centers_x, centers_y = lefts+widths//2, tops+heights//2
+    join_y = rng.random_sample(shape) < loops
+    join_y[0,:] = True
+    walls = np.ones((size, size), dtype=bool)
+    for i in range(count):
+        for j in range(count):
+            left, top = lefts[i,j], tops[i,j]
+            walls[left:left+widths[i,j], top:top+heights[i,j]] = False
+            start = centers_x[i,j], centers_y[i,j]
+            if i+1 < count:
+                carve_corridor(walls, start,
+                               (centers_x[i+1,j], centers_y[i+1,j]))
+            if j+1 < count and join_y[i,j]:
+                carve_corridor(walls, start,
+                               (centers_x[i,j+1], centers_y[i,j+1]))
+    return walls
+
+
+def carve_corridor(walls, start, end):
+    """Clear an L-shaped corridor, first along x and then along y."""
+    (x1, y1), (x2, y2) = start, end
+    walls[min(x1,x2):max(x1,x2)+1, y1] = False
+    walls[x2, min(y1,y2):max(y1,y2)+1] = False
@@ -1,9 +1,14 @@
 import os
 import sys
 import math
+import zlib
 import random
-import itertools
+import timeit
+import numpy as np
 import pygame as pg
+import mapgen
+import replay
+import kernels
 
 from collections import namedtuple
 
@@ -17,12 +22,32 @@ SCREEN_SIZE = (1200, 600)
 CIRCLE = 2*math.pi
 SCALE = (SCREEN_SIZE[0]+SCREEN_SIZE[1])/1200.0
 FIELD_OF_VIEW = math.pi*0.4
-NO_WALL = float("inf")
 RAIN_COLOR = (255, 255, 255, 40)
+MAP_ALGORITHM = os.environ.get("RAYCAST_MAP", mapgen.DEFAULT_ALGORITHM)
+MAP_SEED = os.environ.get("RAYCAST_SEED")
+SPAWN_POINT = (15.3, -1.2)
+MAP_SIZE = 32
+RECORD_PATH = os.environ.get("RAYCAST_RECORD")
+REPLAY_PATH = os.environ.get("RAYCAST_REPLAY")
+FRAME_LOG_PATH = os.environ.get("RAYCAST_FRAME_LOG")
+
+# The only keys that affect the game, and so the only ones replays store.
+REPLAY_KEYS = (pg.K_LEFT, pg.K_RIGHT, pg.K_UP, pg.K_DOWN)
+SURFACE_TEXTURE_SIZE = 256
+MIN_MIP_SIZE = 16
+MINIMAP_SIZE = 192
+MINIMAP_CELLS = 32
+MINIMAP_FLOOR_COLOR = (40, 40, 40)
+MINIMAP_RAY_COLOR = (255, 220, 0)
+
+# Multiplicative tints applied to the wall texture to create each material.
+# Material IDs in the wall grid are indices into this tuple plus one, so
+# that zero can mean an empty cell.
+MATERIAL_TINTS = ((255, 255, 255), (255, 185, 150),
+                  (170, 215, 165), (160, 175, 220))
 
 
 # Semantically meaningful tuples for use in GameMap and Camera class.
-RayInfo = namedtuple("RayInfo", ["sin", "cos"])
 WallInfo = namedtuple("WallInfo", ["top", "height"])
 
 
@@ -34,6 +59,78 @@ class Image(object):
         """
         self.image = image
         self.width, self.height = self.image.get_size()
+        self._pixels = None
+
+    @property
+    def pixels(self):
+        """
+        A (width, height, 3) array copy of the image, created on first use
+        so that images which are never sampled per pixel cost nothing.
+        """
+        if self._pixels is None:
+            self._pixels = pg.surfarray.array3d(self.image)
+        return self._pixels
+
+
+class TextureAtlas(object):
+    """
+    Packs several equally sized textures side by side into a single surface
+    and keeps a chain of pre-downscaled copies of it (mipmaps).  Every one
+    pixel wide column of every level is cut out ahead of time, so looking up
+    the slice for a wall column is nothing more than list indexing.
+    """
+    def __init__(self, textures):
+        """
+        The textures argument is a sequence of preloaded and converted
+        pg.Surface objects, all of the same square size.  The texture at
+        index 0 belongs to material ID 1.
+        """
+        self.count = len(textures)
+        size = textures[0].get_width()
+        atlas = pg.Surface((size*self.count, size)).convert()
+        for i, texture in enumerate(textures):
+            atlas.blit(texture, (i*size, 0))
+        self.levels = []
+        while True:
+            self.levels.append(Image(atlas))
+            if size//2 < MIN_MIP_SIZE:
+                break
+            size //= 2
+            atlas = pg.transform.smoothscale(atlas, (size*self.count, size))
+        self.columns = [self.cut_columns(level) for level in self.levels]
+        self.size = self.levels[0].height
+        self.level_for_height = self.make_level_table()
+
+    def cut_columns(self, level):
+        """Return a list of every one pixel wide column in an atlas level."""
+        columns = []
+        for x in range(level.width):
+            rect = pg.Rect(x, 0, 1, level.height)
+            columns.append(level.image.subsurface(rect))
+        return columns
+
+    def make_level_table(self):
+        """
+        Map every on screen wall height from 0 to the full texture size to
+        the smallest level that still has at least that many texels.
+        """
+        table = []
+        for height in range(self.size+1):
+            level = 0
+            while (level+1 < len(self.levels) and
+                       self.levels[level+1].height >= height):
+                level += 1
+            table.append(level)
+        return table
+
+    def column(self, material, offset, height):
+        """
+        Return the column of the given material's texture at the fractional
+        offset, taken from the level best suited to the on screen height.
+        """
+        level = self.level_for_height[min(max(height, 0), self.size)]
+        size = self.levels[level].height
+        return self.columns[level][(material-1)*size+int(size*offset)]
 
 
 class Player(object):
@@ -88,107 +185,110 @@ class GameMap(object):
     A class to generate a random map for us; handle ray casting;
     and provide a method of detecting colissions.
     """
-    def __init__(self, size):
+    def __init__(self, size, seed=None, algorithm=mapgen.DEFAULT_ALGORITHM):
         """
         The size argument is an integer which tells us the width and height
         of our game grid.  For example, a size of 32 will create a 32x32 map.
+        The same seed always generates the same map; if it is None a random
+        seed is picked and kept in self.seed.  The algorithm argument names
+        one of the generators in mapgen.ALGORITHMS.
         """
         self.size = size
+        self.seed = random.randrange(2**32) if seed is None else int(seed)
+        self.algorithm = algorithm
         self.wall_grid = self.randomize()
         self.sky_box = Image(IMAGES["sky"])
-        self.wall_texture = Image(IMAGES["texture"])
-        self.light = 0
+        self.wall_textures = TextureAtlas(IMAGES["materials"])
+        self.floor_texture = Image(IMAGES["floor"])
+        self.ceiling_texture = Image(IMAGES["ceiling"])
+        self.light = 0.0
+        self.kernels = kernels.load()
 
     def get(self, x, y):
-        """A method to check if a given coordinate is colliding with a wall."""
-        point = (int(math.floor(x)), int(math.floor(y)))
-        return self.wall_grid.get(point, -1)
+        """
+        A method to check if a given coordinate is colliding with a wall.
+        Returns the material ID of the cell (zero if empty), or -1 if the
+        coordinate is off the map.
+        """
+        x, y = int(math.floor(x)), int(math.floor(y))
+        if 0 <= x < self.size and 0 <= y < self.size:
+            return self.wall_grid.item(x, y)
+        return -1
 
     def randomize(self):
         """
-        Generate our map randomly.  In the code below their is a 30% chance
-        of a cell containing a wall.
-        """
-        coordinates = itertools.product(range(self.size), repeat=2)
-        return {coord : random.random()<0.3 for coord in coordinates}
-
-    def cast_ray(self, point, angle, cast_range):
-        """
-        The meat of our ray casting program.  Given a point,
-        an angle (in radians), and a maximum cast range, check if any
-        collisions with the ray occur.  Casting will stop if a collision is
-        detected (cell with greater than 0 height), or our maximum casting
-        range is exceeded without detecting anything.
-        """
-        info = RayInfo(math.sin(angle), math.cos(angle))
-        origin = Point(point)
-        ray = [origin]
-        while origin.height <= 0 and origin.distance <= cast_range:
-            dist = origin.distance
-            step_x = origin.step(info.sin, info.cos)
-            step_y = origin.step(info.cos, info.sin, invert=True)
-            if step_x.length < step_y.length:
-                next_step = step_x.inspect(info, self, 1, 0, dist, step_x.y)
-            else:
-                next_step = step_y.inspect(info, self, 0, 1, dist, step_y.x)
-            ray.append(next_step)
-            origin = next_step
-        return ray
+        Generate our map from self.seed with the chosen algorithm.  Each wall
+        is given a random material.
+        """
+        materials = np.arange(1, len(MATERIAL_TINTS)+1, dtype=np.uint8)
+        return mapgen.generate(self.algorithm, self.size, self.seed, materials)
+
+    def cast_rays(self, point, angles, cast_range):
+        """
+        The meat of our ray casting program.  Given a point, a sequence of
+        angles (in radians), and a maximum cast range, check if any
+        collisions with each ray occur.  Casting will stop if a collision is
+        detected (cell with a material greater than 0), or our maximum
+        casting range is exceeded without detecting anything.  The work is
+        done by the selected kernel backend; the returned steps and counts
+        are described in kernels.py.
+        """
+        x, y = point
+        return self.kernels.cast_rays(self.wall_grid, x, y, angles,
+                                      cast_range)
 
     def update(self, dt):
         """Adjust ambient lighting based on time."""
         if self.light > 0:
-            self.light = max(self.light-10*dt, 0)
+            self.light = max(self.light-10*dt, 0.0)
         elif random.random()*5 < dt:
-            self.light = 2
+            self.light = 2.0
 
 
-class Point(object):
+class Minimap(object):
     """
-    A fairly basic class to assist us with ray casting.  The return value of
-    the GameMap.cast_ray() method is a list of Point instances.
+    A top-down debug view of the map around the player, drawn in the corner
+    of the screen.  The wall grid is rendered once to a cached surface at
+    one pixel per cell and only rebuilt when the game map gets a new
+    wall_grid, so each frame just scales the window around the player and
+    outlines the frame's ray endpoints with a single line draw.  The cost
+    per frame does not depend on the size of the map.
     """
-    def __init__(self, point, length=None):
-        self.x = point[0]
-        self.y = point[1]
-        self.height = 0
-        self.distance = 0
-        self.shading = None
-        self.length = length
-
-    def step(self, rise, run, invert=False):
+    def __init__(self, size, cells):
         """
-        Return a new Point advanced one step from the caller.  If run is
-        zero, the length of the new Point will be infinite.
+        The size argument is the width and height of the minimap in pixels;
+        cells is how many map cells it shows across.
         """
-        try:
-            x, y = (self.y,self.x) if invert else (self.x,self.y)
-            dx = math.floor(x+1)-x if run > 0 else math.ceil(x-1)-x
-            dy = dx*(rise/run)
-            next_x = y+dy if invert else x+dx
-            next_y = x+dx if invert else y+dy
-            length = math.hypot(dx, dy)
-        except ZeroDivisionError:
-            next_x = next_y = None
-            length = NO_WALL
-        return Point((next_x,next_y), length)
-
-    def inspect(self, info, game_map, shift_x, shift_y, distance, offset):
-        """
-        Ran when the step is selected as the next in the ray.
-        Sets the steps self.height, self.distance, and self.shading,
-        to the required values.
-        """
-        dx = shift_x if info.cos<0 else 0
-        dy = shift_y if info.sin<0 else 0
-        self.height = game_map.get(self.x-dx, self.y-dy)
-        self.distance = distance+self.length
-        if shift_x:
-            self.shading = 2 if info.cos<0 else 0
-        else:
-            self.shading = 2 if info.sin<0 else 1
-        self.offset = offset-math.floor(offset)
-        return self
+        self.size = size
+        self.cells = cells
+        self.image = pg.Surface((size, size)).convert()
+        self.grid = None
+        self.cache = None
+
+    def rebuild(self, grid):
+        """Render the wall grid, colored by material, to the cache."""
+        palette = np.array((MINIMAP_FLOOR_COLOR,)+MATERIAL_TINTS, np.uint8)
+        self.cache = pg.surfarray.make_surface(palette[grid]).convert()
+        self.grid = grid
+
+    def draw(self, surface, player, game_map, ray_ends):
+        """
+        Draw the minimap to the top left of surface.  The ray_ends argument
+        is a list of the (x, y) map coordinates where this frame's rays
+        stopped.
+        """
+        if game_map.wall_grid is not self.grid:
+            self.rebuild(game_map.wall_grid)
+        cells = min(self.cells, game_map.size)
+        left = min(max(int(player.x)-cells//2, 0), game_map.size-cells)
+        top = min(max(int(player.y)-cells//2, 0), game_map.size-cells)
+        window = self.cache.subsurface((left, top, cells, cells))
+        pg.transform.scale(window, (self.size, self.size), self.image)
+        scale = self.size/float(cells)
+        points = [((x-left)*scale, (y-top)*scale)
+                  for x, y in [(player.x, player.y)]+ray_ends]
+        pg.draw.lines(self.image, MINIMAP_RAY_COLOR, True, points)
+        surface.blit(self.image, (0, 0))
 
 
 class Camera(object):
@@ -203,80 +303,165 @@ class Camera(object):
         self.light_range = 5
         self.scale = SCALE
         self.flash = pg.Surface((self.width, self.height//2)).convert_alpha()
+        self.floor_casting = True
+        self.ceiling_casting = False
+        self.minimap = Minimap(MINIMAP_SIZE, MINIMAP_CELLS)
+        self.ray_ends = []
+        self.kernels = kernels.load()
+        self.prepare_surface_casting()
+
+    def prepare_surface_casting(self):
+        """
+        Precompute everything floor and ceiling casting needs that does not
+        depend on the player.  Each screen row below the horizon sees the
+        floor at a fixed perpendicular distance (the inverse of project()),
+        and each column looks along a fixed angle relative to the player,
+        so the distance to every floor sample is constant between frames.
+        The ceiling is the floor mirrored about the horizon.
+        """
+        columns, rows = int(self.resolution), self.height//2
+        angles = self.field_of_view*(np.arange(columns)/self.resolution-0.5)
+        row_centers = np.arange(rows)+0.5
+        z = (self.height/2.0)/row_centers
+        self.column_angles = angles
+        distance = z[np.newaxis,:]/np.cos(angles)[:,np.newaxis]
+        self.surface_distance = distance.astype(np.float32)
+        self.floor_slice = pg.Surface((columns, rows)).convert()
 
     def render(self, player, game_map):
-        """Render everything in order."""
-        self.draw_sky(player.direction, game_map.sky_box, game_map.light)
+        """
+        Render everything in order.  The sky is only skipped when the floor
+        and ceiling together cover the whole screen.
+        """
+        if not (self.floor_casting and self.ceiling_casting):
+            self.draw_sky(player.direction, game_map.sky_box, game_map.light)
+        self.draw_surfaces(player, game_map)
         self.draw_columns(player, game_map)
         self.draw_weapon(player.weapon, player.paces)
+        if self.minimap:
+            self.minimap.draw(self.screen, player, game_map, self.ray_ends)
 
     def draw_sky(self, direction, sky, ambient_light):
         """
         Calculate the skies offset so that it wraps, and draw.
         If the ambient light is greater than zero, draw lightning flash.
+        When the floor is cast it covers the flash, and is brightened by the
+        ambient light itself, so the flash is skipped.
         """
         left = -sky.width*direction/CIRCLE
         self.screen.blit(sky.image, (left,0))
         if left<sky.width-self.width:
             self.screen.blit(sky.image, (left+sky.width,0))
-        if ambient_light > 0:
+        if ambient_light > 0 and not self.floor_casting:
             alpha = 255*min(1, ambient_light*0.1)
             self.flash.fill((255,255,255,alpha))
             self.screen.blit(self.flash, (0, self.height//2))
 
+    def draw_surfaces(self, player, game_map):
+        """
+        Cast the floor (and optionally the ceiling) for the whole frame at
+        once.  World coordinates, texture coordinates and shading are
+        computed as arrays at column resolution, written to a small surface
+        in one go, and scaled up to the screen.  Shading uses the same
+        kernels.shade_numpy as the walls.
+        """
+        if not (self.floor_casting or self.ceiling_casting):
+            return
+        directions = player.direction+self.column_angles
+        cos = np.cos(directions).astype(np.float32)[:,np.newaxis]
+        sin = np.sin(directions).astype(np.float32)[:,np.newaxis]
+        distance = self.surface_distance
+        world_x = distance*cos+np.float32(player.x)
+        world_y = distance*sin+np.float32(player.y)
+        frac_x = world_x-np.floor(world_x)
+        frac_y = world_y-np.floor(world_y)
+        alphas = kernels.shade_numpy(distance, 0,
+                                     np.float32(game_map.light),
+                                     np.float32(self.light_range))
+        shade = 1-alphas[:,:,np.newaxis]/np.float32(255)
+        half_size = (self.width, self.height//2)
+        if self.floor_casting:
+            floor = self.sample_surface(game_map.floor_texture, frac_x, frac_y)
+            pg.surfarray.blit_array(self.floor_slice, floor*shade)
+            floor_rect = pg.Rect((0, self.height//2), half_size)
+            pg.transform.scale(self.floor_slice, half_size,
+                               self.screen.subsurface(floor_rect))
+        if self.ceiling_casting:
+            ceiling = self.sample_surface(game_map.ceiling_texture,
+                                          frac_x, frac_y)
+            pg.surfarray.blit_array(self.floor_slice, (ceiling*shade)[:,::-1])
+            ceiling_rect = pg.Rect((0, 0), half_size)
+            pg.transform.scale(self.floor_slice, half_size,
+                               self.screen.subsurface(ceiling_rect))
+
+    def sample_surface(self, texture, frac_x, frac_y):
+        """
+        Look up the texels for arrays of fractional cell coordinates.
+        Returns a (columns, rows, 3) array.
+        """
+        texture_x = (frac_x*texture.width).astype(int)%texture.width
+        texture_y = (frac_y*texture.height).astype(int)%texture.height
+        texels = texture.pixels.reshape(-1, 3)
+        return texels.take(texture_x*texture.height+texture_y, axis=0)
+
     def draw_columns(self, player, game_map):
         """
-        For every column in the given resolution, cast a ray, and render that
-        column.
-        """
-        for column in range(int(self.resolution)):
-            angle = self.field_of_view*(column/self.resolution-0.5)
-            point = player.x, player.y
-            ray = game_map.cast_ray(point, player.direction+angle, self.range)
-            self.draw_column(column, ray, angle, game_map)
-
-    def draw_column(self, column, ray, angle, game_map):
+        Cast a ray for every column in the given resolution, work out the
+        shadows for every step at once, and render each column.  Where each
+        ray ended is kept in self.ray_ends for the minimap.
+        """
+        point = player.x, player.y
+        directions = player.direction+self.column_angles
+        steps, counts = game_map.cast_rays(point, directions, self.range)
+        alphas = self.kernels.shade(steps[:,:,kernels.DISTANCE],
+                                    steps[:,:,kernels.SHADING],
+                                    float(game_map.light),
+                                    float(self.light_range))
+        steps, alphas = steps.tolist(), alphas.tolist()
+        self.ray_ends = []
+        for column, angle in enumerate(self.column_angles.tolist()):
+            ray = steps[column][:counts[column]]
+            self.ray_ends.append((ray[-1][kernels.X], ray[-1][kernels.Y]))
+            self.draw_column(column, ray, alphas[column], angle, game_map)
+
+    def draw_column(self, column, ray, alphas, angle, game_map):
         """
         Examine each step of the ray, starting with the furthest.
-        If the height is greater than zero, render the column (and shadow).
+        If the material is greater than zero, render the column (and shadow).
         Rain drops will be drawn for every step.
         """
         left = int(math.floor(column*self.spacing))
         for ray_index in range(len(ray)-1, -1, -1):
-            step = ray[ray_index]
-            if step.height > 0:
-                texture = game_map.wall_texture
+            _, _, distance, material, _, offset = ray[ray_index]
+            if material > 0:
+                textures = game_map.wall_textures
                 width = int(math.ceil(self.spacing))
-                texture_x = int(texture.width*step.offset) ###
-                wall = self.project(step.height, angle, step.distance)
-                image_location = pg.Rect(texture_x, 0, 1, texture.height)
-                image_slice = texture.image.subsurface(image_location)
+                wall = self.project(1, angle, distance)
+                image_slice = textures.column(int(material), offset,
+                                              wall.height)
                 scale_rect = pg.Rect(left, wall.top, width, wall.height)
                 scaled = pg.transform.scale(image_slice, scale_rect.size)
                 self.screen.blit(scaled, scale_rect)
-                self.draw_shadow(step, scale_rect, game_map.light)
-            self.draw_rain(step, angle, left, ray_index)
+                self.draw_shadow(alphas[ray_index], scale_rect)
+            self.draw_rain(distance, angle, left, ray_index)
 
-    def draw_shadow(self, step, scale_rect, light):
+    def draw_shadow(self, alpha, scale_rect):
         """
-        Render the shadow on a column with regards to its distance and
-        shading attribute.
+        Render the shadow on a column.  The alpha comes from the kernel
+        backend's shade(), based on the step's distance and shading.
         """
-        shade_value = step.distance+step.shading
-        max_light = shade_value/float(self.light_range)-light
-        alpha = 255*min(1, max(max_light, 0))
         shade_slice = pg.Surface(scale_rect.size).convert_alpha()
         shade_slice.fill((0,0,0,alpha))
         self.screen.blit(shade_slice, scale_rect)
 
-    def draw_rain(self, step, angle, left, ray_index):
+    def draw_rain(self, distance, angle, left, ray_index):
         """
         Render a number of rain drops to add depth to our scene and mask
         roughness.
         """
         rain_drops = int(random.random()**3*ray_index)
         if rain_drops:
-            rain = self.project(0.1, angle, step.distance)
+            rain = self.project(0.1, angle, distance)
             drop = pg.Surface((1,rain.height)).convert_alpha()
             drop.fill(RAIN_COLOR)
         for _ in range(rain_drops):
@@ -308,7 +493,8 @@ class Camera(object):
 class Control(object):
     """
     The core of our program.  Responsible for running our main loop;
-    processing events; updating; and rendering.
+    processing events; updating; and rendering.  Sessions can be recorded
+    to, or played back from, a replay file (see replay.py).
     """
     def __init__(self):
         self.screen = pg.display.get_surface()
@@ -316,10 +502,49 @@ class Control(object):
         self.fps = 60.0
         self.keys = pg.key.get_pressed()
         self.done = False
-        self.player = Player(15.3, -1.2, math.pi*0.3)
-        self.game_map = GameMap(32)
+        self.recorder = None
+        self.playback = None
+        self.frame_log = None
+        self.setup_replay()
+        self.player = self.spawn_player()
         self.camera = Camera(self.screen, 300)
 
+    def setup_replay(self):
+        """
+        Create the game map and seed the random module, either from a replay
+        file's header or fresh (optionally recording the session).  The map
+        must come first, as picking a map seed may itself draw from random.
+        Playback runs without a frame rate cap so frame times can be
+        compared.
+        """
+        if REPLAY_PATH:
+            self.playback = replay.Playback(REPLAY_PATH)
+            self.fps = 0
+            rng_seed = self.playback.rng_seed
+            map_args = (self.playback.map_size, self.playback.map_seed,
+                        self.playback.algorithm)
+        else:
+            rng_seed = random.randrange(2**32)
+            map_args = (MAP_SIZE, MAP_SEED, MAP_ALGORITHM)
+        self.game_map = GameMap(*map_args)
+        random.seed(rng_seed)
+        if RECORD_PATH and not self.playback:
+            self.recorder = replay.Recorder(RECORD_PATH, rng_seed,
+                                            self.game_map.seed,
+                                            self.game_map.algorithm,
+                                            self.game_map.size)
+        if FRAME_LOG_PATH:
+            self.frame_log = replay.FrameLog(FRAME_LOG_PATH)
+
+    def spawn_player(self):
+        """
+        Place the player in the open cell nearest SPAWN_POINT, as some map
+        algorithms wall off the whole border and off the map is walkable.
+        """
+        grid = self.game_map.wall_grid
+        x, y = mapgen.nearest_open_cell(grid, *SPAWN_POINT) or SPAWN_POINT
+        return Player(x, y, math.pi*0.3)
+
     def event_loop(self):
         """
         Quit game on a quit event and update self.keys on any keyup or keydown.
@@ -327,9 +552,33 @@ class Control(object):
         for event in pg.event.get():
             if event.type == pg.QUIT:
                 self.done = True
-            elif event.type in (pg.KEYDOWN, pg.KEYUP):
+            elif event.type in (pg.KEYDOWN, pg.KEYUP) and not self.playback:
                 self.keys = pg.key.get_pressed()
 
+    def replay_frame(self, dt):
+        """
+        When playing back, replace the measured dt (in milliseconds) and the
+        key state with the recorded ones; when recording, store them.  The
+        dt is clamped to what a replay can store, so a recorded session plays
+        back exactly even after a long stall.  Returns the dt to use, or None
+        once the playback has run out.
+        """
+        dt = min(dt, replay.MAX_DT)
+        if self.playback:
+            frame = self.playback.next_frame()
+            if frame is None:
+                return None
+            dt, mask = frame
+            self.keys = replay.KeyState(mask, REPLAY_KEYS)
+        elif self.recorder:
+            self.recorder.record(dt, replay.pack_keys(self.keys, REPLAY_KEYS))
+        return dt
+
+    def log_frame(self, milliseconds):
+        """Write the rendered frame's hash and time to the frame log."""
+        frame_hash = zlib.crc32(self.screen.get_buffer().raw) & 0xFFFFFFFF
+        self.frame_log.write(frame_hash, milliseconds)
+
     def update(self, dt):
         """Update the game_map and player."""
         self.game_map.update(dt)
@@ -337,19 +586,34 @@ class Control(object):
 
     def display_fps(self):
         """Show the program's FPS in the window handle."""
-        caption = "{} - FPS: {:.2f}".format(CAPTION, self.clock.get_fps())
+        caption = "{} - Seed: {} - FPS: {:.2f}".format(
+            CAPTION, self.game_map.seed, self.clock.get_fps())
         pg.display.set_caption(caption)
 
     def main_loop(self):
-        """Process events, update, and render."""
-        dt = self.clock.tick(self.fps)/1000.0
-        while not self.done:
-            self.event_loop()
-            self.update(dt)
-            self.camera.render(self.player, self.game_map)
-            dt = self.clock.tick(self.fps)/1000.0
-            pg.display.update()
-            self.display_fps()
+        """
+        Process events, update, and render.  The replay and frame log files
+        are closed however the loop ends, so no recorded frames are lost.
+        """
+        dt = self.clock.tick(self.fps)
+        try:
+            while not self.done:
+                self.event_loop()
+                dt = self.replay_frame(dt)
+                if dt is None:
+                    break
+                start = timeit.default_timer()
+                self.update(dt/1000.0)
+                self.camera.render(self.player, self.game_map)
+                if self.frame_log:
+                    self.log_frame((timeit.default_timer()-start)*1000)
+                dt = self.clock.tick(self.fps)
+                pg.display.update()
+                self.display_fps()
+        finally:
+            for log in (self.recorder, self.frame_log):
+                if log:
+                    log.close()
 
 
 def load_resources():
@@ -362,6 +626,14 @@ def load_resources():
     knife_scale = (int(knife_w*SCALE), int(knife_h*SCALE))
     images["knife"] = pg.transform.smoothscale(knife_image, knife_scale)
     images["texture"] = pg.image.load("wall_texture.jpg").convert()
+    images["materials"] = []
+    for tint in MATERIAL_TINTS:
+        material = images["texture"].copy()
+        material.fill(tint, special_flags=pg.BLEND_MULT)
+        images["materials"].append(material)
+    surface_size = (SURFACE_TEXTURE_SIZE, SURFACE_TEXTURE_SIZE)
+    surface_image = pg.transform.smoothscale(images["texture"], surface_size)
+    images["floor"] = images["ceiling"] = surface_image
     sky_size = int(SCREEN_SIZE[0]*(CIRCLE/FIELD_OF_VIEW)), SCREEN_SIZE[1]
     sky_box_image = pg.image.load("deathvalley_panorama.jpg").convert()
     images["sky"] = pg.transform.smoothscale(sky_box_image, sky_size)
@@ -8,8 +8,8 @@ import os
 import sys
 import math
 import random
-import itertools
 import pygame as pg
+import mapgen
 
 from collections import namedtuple
 
@@ -25,6 +25,9 @@ SCALE = (SCREEN_SIZE[0]+SCREEN_SIZE[1])/1200.0
 FIELD_OF_VIEW = math.pi*0.4
 NO_WALL = float("inf")
 RAIN_COLOR = (255, 255, 255, 40)
+MAP_ALGORITHM = os.environ.get("RAYCAST_MAP", mapgen.DEFAULT_ALGORITHM)
+MAP_SEED = os.environ.get("RAYCAST_SEED")
+SPAWN_POINT = (15.3, -1.2)
 
 
 # Semantically meaningful tuples for use in GameMap and Camera class.
@@ -94,32 +97,40 @@ class GameMap(object):
     A class to generate a random map for us; handle ray casting;
     and provide a method of detecting colissions.
     """
-    def __init__(self, size):
+    def __init__(self, size, seed=None, algorithm=mapgen.DEFAULT_ALGORITHM):
         """
         The size argument is an integer which tells us the width and height
         of our game grid.  For example, a size of 32 will create a 32x32 map.
+        The same seed always generates the same map; if it is None a random
+        seed is picked and kept in self.seed.  The algorithm argument names
+        one of the generators in mapgen.ALGORITHMS.
         """
         self.size = size
+        self.seed = random.randrange(2**32) if seed is None else int(seed)
+        self.algorithm = algorithm
         self.wall_grid = self.randomize()
         self.sky_box = Image(IMAGES["sky"])
         self.wall_texture = Image(IMAGES["texture"])
         self.light = 0
 
     def get(self, x, y):
-        """A method to check if a given coordinate is colliding with a wall."""
-        point = (int(math.floor(x)), int(math.floor(y)))
-        return self.wall_grid.get(point, -1)
+        """
+        A method to check if a given coordinate is colliding with a wall.
+        Returns the height of the cell (zero if empty), or -1 if the
+        coordinate is off the map.
+        """
+        x, y = int(math.floor(x)), int(math.floor(y))
+        if 0 <= x < self.size and 0 <= y < self.size:
+            return self.wall_grid.item(x, y)
+        return -1
 
     def randomize(self):
         """
-        Generate our map randomly.  In the code below their is a 30% chance
-        of a cell containing a wall.
+        Generate our map from self.seed with the chosen algorithm.  Each wall
+        is given a random height.
         """
-        game_map = {}
-        for coord in itertools.product(range(self.size), repeat=2):
-            if random.random()<0.3:
-                game_map[coord] = random.choice((0.6, 1, 1.5))
-        return game_map
+        heights = (0.6, 1, 1.5)
+        return mapgen.generate(self.algorithm, self.size, self.seed, heights)
 
     def cast_ray(self, point, angle, cast_range):
         """
@@ -323,10 +334,19 @@ class Control(object):
         self.fps = 60.0
         self.keys = pg.key.get_pressed()
         self.done = False
-        self.player = Player(15.3, -1.2, math.pi*0.3)
-        self.game_map = GameMap(32)
+        self.game_map = GameMap(32, MAP_SEED, MAP_ALGORITHM)
+        self.player = self.spawn_player()
         self.camera = Camera(self.screen, 300)
 
+    def spawn_player(self):
+        """
+        Place the player in the open cell nearest SPAWN_POINT, as some map
+        algorithms wall off the whole border and off the map is walkable.
+        """
+        grid = self.game_map.wall_grid
+        x, y = mapgen.nearest_open_cell(grid, *SPAWN_POINT) or SPAWN_POINT
+        return Player(x, y, math.pi*0.3)
+
     def event_loop(self):
         """
         Quit game on a quit event and update self.keys on any keyup or keydown.
@@ -344,7 +364,8 @@ class Control(object):
 
     def display_fps(self):
         """Show the program's FPS in the window handle."""
-        caption = "{} - FPS: {:.2f}".format(CAPTION, self.clock.get_fps())
+        caption = "{} - Seed: {} - FPS: {:.2f}".format(
+            CAPTION, self.game_map.seed, self.clock.get_fps())
         pg.display.set_caption(caption)
 
     def main_loop(self):
@@ -0,0 +1,123 @@
+"""
+Compact binary recording and deterministic playback of a play session.
+
+A replay file starts with a header holding everything needed to rebuild
+the same world (the seed for the random module, plus the map seed,
+algorithm and size) and is followed by three bytes per frame: the frame's
+dt in whole milliseconds and a bit mask of the tracked keys held down.
+Because every other source of randomness is seeded from the header,
+feeding those frames back reproduces the session exactly.
+
+Playback can also write a frame log with a hash of every rendered frame and
+the time it took, so visual and timing regressions can be bisected offline.
+"""
+
+import struct
+
+
+MAGIC = b"RCRP"
+VERSION = 1
+HEADER = struct.Struct("<4sBIIHB")
+FRAME = struct.Struct("<HB")
+
+# The largest dt, in milliseconds, a frame can store.  Longer frames must be
+# clamped to this before they are used as well as recorded, or playback
+# would diverge.
+MAX_DT = 0xFFFF
+
+
+class ReplayError(Exception):
+    """Raised when a file is not a replay this version can read."""
+
+
+class KeyState(object):
+    """
+    Stands in for pg.key.get_pressed() during playback.  Indexing with a
+    tracked key constant tells whether that key was held down.
+    """
+    def __init__(self, mask, tracked):
+        self.mask = mask
+        self.tracked = tracked
+
+    def __getitem__(self, key):
+        try:
+            return bool(self.mask & 1<<self.tracked.index(key))
+        except ValueError:
+            return False
+
+
+def pack_keys(keys, tracked):
+    """Return a bit mask of which tracked keys are held in keys."""
+    mask = 0
+    for bit, key in enumerate(tracked):
+        if keys[key]:
+            mask |= 1<<bit
+    return mask
+
+
+class Recorder(object):
+    """Writes a replay file frame by frame as the game runs."""
+    def __init__(self, path, rng_seed, map_seed, algorithm, map_size):
+        name = algorithm.encode("utf-8")
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, rng_seed, map_seed,
+                                    map_size, len(name)))
+        self.file.write(name)
+
+    def record(self, dt, mask):
+        """Store one frame; dt is in milliseconds, at most MAX_DT."""
+        self.file.write(FRAME.pack(dt, mask))
+
+    def close(self):
+        self.file.close()
+
+
+class Playback(object):
+    """Reads a replay file and hands back its frames in order."""
+    def __init__(self, path):
+        with open(path, "rb") as replay_file:
+            data = replay_file.read()
+        if len(data) < HEADER.size:
+            raise ReplayError("{} is too short to be a replay.".format(path))
+        magic, version, rng_seed, map_seed, map_size, name_length = (
+            HEADER.unpack_from(data))
+        if magic != MAGIC or version != VERSION:
+            raise ReplayError("{} is not a version {} replay.".format(
+                path, VERSION))
+        start = HEADER.size+name_length
+        self.rng_seed = rng_seed
+        self.map_seed = map_seed
+        self.map_size = map_size
+        self.algorithm = data[HEADER.size:start].decode("utf-8")
+        end = len(data)-FRAME.size+1
+        offsets = range(start, end, FRAME.size)
+        self.frames = [FRAME.unpack_from(data, i) for i in offsets]
+        self.index = 0
+
+    def next_frame(self):
+        """Return the next (dt, mask) pair, or None once all are used."""
+        if self.index >= len(self.frames):
+            return None
+        frame = self.frames[self.index]
+        self.index += 1
+        return frame
+
+
+class FrameLog(object):
+    """
+    Writes one "frame,hash,milliseconds" line per rendered frame.  Diffing
+    the hash column between two builds finds the first frame that renders
+    differently; the last column shows where frame times changed.
+    """
+    def __init__(self, path):
+        self.file = open(path, "w")
+        self.file.write("frame,hash,milliseconds\n")
+        self.count = 0
+
+    def write(self, frame_hash, milliseconds):
+        line = "{},{:08x},{:.3f}\n"
+        self.file.write(line.format(self.count, frame_hash, milliseconds))
+        self.count += 1
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,129 @@
+"""
+Parity tests for the kernel backends in kernels.py.  Every available backend
+must produce exactly the same hit data and shadows as the pure Python one
+for the same map and pose.  Run with: python -m pytest
+"""
+
+import os
+import math
+import numpy as np
+import pytest
+
+import kernels
+import mapgen
+
+
+CAST_RANGE = 8
+LIGHT_RANGE = 5.0
+
+MAPS = [(algorithm, 32, seed) for algorithm in sorted(mapgen.ALGORITHMS)
+                              for seed in (1, 2)]
+
+# Poses include points on grid lines, off the map, and rays along the axes
+# (where one of the step lengths is infinite).
+POSES = [(5.5, 5.5, 0.3), (15.3, -1.2, math.pi*0.3), (16.0, 16.0, 0.0),
+         (3.25, 28.0, math.pi/2), (31.9, 0.1, math.pi), (40.0, 40.0, 3.9),
+         (10.5, 20.5, -math.pi/2)]
+
+ANGLES = math.pi*0.4*(np.arange(300)/300.0-0.5)
+
+OTHER_BACKENDS = [name for name in sorted(kernels.BACKENDS)
+                  if name != "python"]
+
+
+def load_or_skip(name):
+    if name not in kernels.available():
+        pytest.skip("{} backend is not installed".format(name))
+    return kernels.load(name)
+
+
+def cast(backend, map_spec, pose):
+    algorithm, size, seed = map_spec
+    grid = mapgen.generate(algorithm, size, seed, values=(1, 2, 3, 4))
+    x, y, direction = pose
+    return backend.cast_rays(grid.astype(np.uint8), x, y, direction+ANGLES,
+                             CAST_RANGE)
+
+
+def test_python_ray_stops_at_first_wall():
+    grid = np.zeros((8, 8), dtype=np.uint8)
+    grid[5,2] = 3
+    backend = kernels.load("python")
+    steps, counts = backend.cast_rays(grid, 2.5, 2.5, [0.0], CAST_RANGE)
+    hit = steps[0,counts[0]-1]
+    assert hit[kernels.MATERIAL] == 3
+    assert hit[kernels.X] == 5.0
+    assert hit[kernels.DISTANCE] == 2.5
+    assert hit[kernels.OFFSET] == 0.5
+
+
+def test_python_ray_ends_beyond_range():
+    grid = np.zeros((64, 64), dtype=np.uint8)
+    backend = kernels.load("python")
+    steps, counts = backend.cast_rays(grid, 2.5, 2.5, [0.7], CAST_RANGE)
+    distances = steps[0,:counts[0],kernels.DISTANCE]
+    assert distances[-1] > CAST_RANGE
+    assert (distances[:-1] <= CAST_RANGE).all()
+    assert (steps[0,:counts[0],kernels.MATERIAL] == 0).all()
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        kernels.load("no_such_backend")
+
+
+@pytest.mark.parametrize("name", OTHER_BACKENDS)
+@pytest.mark.parametrize("map_spec", MAPS)
+@pytest.mark.parametrize("pose", POSES)
+def test_cast_rays_parity(name, map_spec, pose):
+    backend = load_or_skip(name)
+    expected_steps, expected_counts = cast(kernels.load("python"),
+                                           map_spec, pose)
+    steps, counts = cast(backend, map_spec, pose)
+    np.testing.assert_array_equal(counts, expected_counts)
+    np.testing.assert_array_equal(steps, expected_steps)
+
+
+@pytest.mark.parametrize("name", OTHER_BACKENDS)
+def test_render_compiles_nothing_new(name, monkeypatch):
+    """
+    The warm up must cover the argument types the game really uses, or the
+    first frame (and the first lightning) pays for another compilation.
+    """
+    backend = load_or_skip(name)
+    pg = pytest.importorskip("pygame")
+    monkeypatch.setenv("SDL_VIDEODRIVER", "dummy")
+    monkeypatch.chdir(os.path.dirname(os.path.abspath(__file__)))
+    import raycast
+    pg.init()
+    try:
+        pg.display.set_mode(raycast.SCREEN_SIZE)
+        monkeypatch.setattr(raycast, "IMAGES", raycast.load_resources(),
+                            raising=False)
+        game_map = raycast.GameMap(32, seed=1)
+        camera = raycast.Camera(pg.display.get_surface(), 300)
+        player = raycast.Player(5.5, 5.5, 0.3)
+        game_map.kernels = camera.kernels = backend
+        kernels_used = (backend.cast_rays_kernel, backend.shade)
+        before = [len(kernel.signatures) for kernel in kernels_used]
+        camera.render(player, game_map)
+        game_map.update(5.0)
+        assert game_map.light > 0
+        camera.render(player, game_map)
+        after = [len(kernel.signatures) for kernel in kernels_used]
+    finally:
+        pg.quit()
+    assert after == before
+
+
+@pytest.mark.parametrize("name", OTHER_BACKENDS)
+@pytest.mark.parametrize("light", [0.0, 0.7, 2.0])
+def test_shade_parity(name, light):
+    backend = load_or_skip(name)
+    steps, _ = cast(kernels.load("python"), MAPS[0], POSES[0])
+    distances = steps[:,:,kernels.DISTANCE]
+    shadings = steps[:,:,kernels.SHADING]
+    expected = kernels.load("python").shade(distances, shadings, light,
+                                            LIGHT_RANGE)
+    alphas = backend.shade(distances, shadings, light, LIGHT_RANGE)
+    np.testing.assert_array_equal(alphas, expected)
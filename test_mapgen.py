@@ -0,0 +1,64 @@
+"""
+Tests for the map generators in mapgen.py: maps must be reproducible from
+their seed, and rooms maps must be fully connected.
+Run with: python -m pytest
+"""
+
+import numpy as np
+import pytest
+
+import mapgen
+
+
+def open_regions(grid):
+    """Count the groups of empty cells joined along x or y."""
+    unvisited = grid == 0
+    size_x, size_y = grid.shape
+    regions = 0
+    for start in map(tuple, np.argwhere(unvisited)):
+        if not unvisited[start]:
+            continue
+        regions += 1
+        unvisited[start] = False
+        stack = [start]
+        while stack:
+            x, y = stack.pop()
+            for cell in ((x+1, y), (x-1, y), (x, y+1), (x, y-1)):
+                if (0 <= cell[0] < size_x and 0 <= cell[1] < size_y and
+                        unvisited[cell]):
+                    unvisited[cell] = False
+                    stack.append(cell)
+    return regions
+
+
+@pytest.mark.parametrize("algorithm", sorted(mapgen.ALGORITHMS))
+def test_same_seed_same_map(algorithm):
+    first = mapgen.generate(algorithm, 32, 7, values=(1, 2, 3))
+    second = mapgen.generate(algorithm, 32, 7, values=(1, 2, 3))
+    np.testing.assert_array_equal(first, second)
+
+
+@pytest.mark.parametrize("algorithm", sorted(mapgen.ALGORITHMS))
+def test_different_seed_different_map(algorithm):
+    first = mapgen.generate(algorithm, 32, 1)
+    second = mapgen.generate(algorithm, 32, 2)
+    assert (first != second).any()
+
+
+@pytest.mark.parametrize("size", [8, 16, 32, 64])
+@pytest.mark.parametrize("seed", range(5))
+def test_rooms_connected(size, seed):
+    grid = mapgen.generate("rooms", size, seed)
+    assert open_regions(grid) == 1
+
+
+def test_unknown_algorithm():
+    with pytest.raises(ValueError):
+        mapgen.generate("no_such_algorithm", 8, 0)
+
+
+def test_background_result_timeout():
+    generator = mapgen.BackgroundGenerator("noise", 2048, 0)
+    with pytest.raises(mapgen.GenerationTimeout):
+        generator.result(0)
+    assert generator.result().shape == (2048, 2048)
@@ -0,0 +1,71 @@
+"""
+Rendering tests for raycast.py, run on SDL's dummy video driver.  They are
+skipped if pygame is not installed.  Run with: python -m pytest
+"""
+
+import os
+import pytest
+
+pg = pytest.importorskip("pygame")
+
+
+RED = (255, 0, 0)
+
+
+@pytest.fixture
+def raycast(monkeypatch):
+    """Import raycast with a dummy display and its images loaded."""
+    monkeypatch.setenv("SDL_VIDEODRIVER", "dummy")
+    monkeypatch.chdir(os.path.dirname(os.path.abspath(__file__)))
+    import raycast
+    pg.init()
+    pg.display.set_mode(raycast.SCREEN_SIZE)
+    monkeypatch.setattr(raycast, "IMAGES", raycast.load_resources(),
+                        raising=False)
+    yield raycast
+    pg.quit()
+
+
+def red_fraction(surface):
+    """Return the fraction of pixels in surface that are still pure red."""
+    pixels = pg.surfarray.pixels3d(surface)
+    red = ((pixels[:,:,0] == 255) & (pixels[:,:,1] == 0) &
+           (pixels[:,:,2] == 0))
+    return red.mean()
+
+
+@pytest.mark.parametrize("floor, ceiling", [(False, False), (True, False),
+                                            (False, True), (True, True)])
+def test_every_surface_mode_paints_the_whole_screen(raycast, floor, ceiling):
+    screen = pg.display.get_surface()
+    game_map = raycast.GameMap(32, seed=1)
+    game_map.wall_grid[:] = 0
+    camera = raycast.Camera(screen, 300)
+    camera.floor_casting, camera.ceiling_casting = floor, ceiling
+    camera.minimap = None
+    player = raycast.Player(16.5, 16.5, 0.3)
+    screen.fill(RED)
+    camera.render(player, game_map)
+    half = camera.height//2
+    lower = screen.subsurface((0, half, camera.width, camera.height-half))
+    upper = screen.subsurface((0, 0, camera.width, half))
+    assert red_fraction(lower) == 0
+    assert red_fraction(upper) == 0
+
+
+def test_lightning_flashes_below_horizon_without_floor(raycast):
+    screen = pg.display.get_surface()
+    game_map = raycast.GameMap(32, seed=1)
+    game_map.wall_grid[:] = 0
+    camera = raycast.Camera(screen, 300)
+    camera.floor_casting, camera.ceiling_casting = False, True
+    camera.minimap = None
+    player = raycast.Player(16.5, 16.5, 0.3)
+    half = camera.height//2
+    brightness = []
+    for light in (0.0, 2.0):
+        game_map.light = light
+        camera.render(player, game_map)
+        lower = screen.subsurface((0, half, camera.width, camera.height-half))
+        brightness.append(pg.surfarray.pixels3d(lower).mean())
+    assert brightness[1] > brightness[0]